@@ -1,34 +1,78 @@
 #!/usr/bin/env python3
 import subprocess
 import os
+import posixpath
+import re
 import sys
+import threading
 import json
-import glob
+import logging
 import argparse
-from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Smallest number of lines worth starting an extra spell checker process for.
+MIN_LINES_PER_JOB = 1000
+
+# Characters of paths passed to one `git diff`, well below the command line
+# limits of Linux, macOS and Windows.
+MAX_PATHSPEC_CHARS = 30000
+
+logger = logging.getLogger("git-spell-check")
+
+# Runs of letters, the way aspell splits text into words.
+WORD_RE = re.compile(r"[^\W\d_]+")
+
+# Hunk header, capturing the first line number of the new file.
+HUNK_RE = re.compile(r"@@ -\d+(?:,\d+)? \+(\d+)")
+
+C_ESCAPES = {b'a': b'\a', b'b': b'\b', b't': b'\t', b'n': b'\n',
+             b'v': b'\v', b'f': b'\f', b'r': b'\r'}
+
+def unquote_path(path):
+    """Undo git's C-style quoting of a path, e.g. '"b/q\\"uote.md"' to 'b/q"uote.md'."""
+    if len(path) < 2 or not (path.startswith('"') and path.endswith('"')):
+        return path
+
+    def unescape(match):
+        escape = match.group(1)
+        if len(escape) == 3:
+            return bytes([int(escape, 8)])
+        return C_ESCAPES.get(escape, escape)
+
+    # Names that are not valid UTF-8 keep a replacement character, as in git's own output.
+    return re.sub(rb'\\([0-7]{3}|.)', unescape, path[1:-1].encode()).decode(errors='replace')
 
 def parse_diff_content(diff_text):
-    """Parse unified diff content and extract changed lines with their line numbers."""
+    """Parse unified diff content and extract changed lines with their line numbers.
+
+    The diff can be given as a string or as an iterable of lines, such as an
+    open file or a pipe, which is then parsed without reading it all first."""
     file_changes = {}
     current_file = None
     current_line = None
 
-    for line in diff_text.splitlines():
-        if line.startswith('+++'):
-            current_file = line[4:]
-            if current_file.startswith('b/'):
-                current_file = current_file[2:]
-        elif line.startswith('@@'):
-            match = next((m for m in line.split() if m.startswith('+')), None)
-            if match:
-                try:
-                    current_line = int(match.split(',')[0][1:])
-                except ValueError:
-                    current_line = None
-        elif line.startswith('+') and not line.startswith('+++'):
-            if current_file and current_line is not None:
+    if isinstance(diff_text, str):
+        lines = diff_text.splitlines()
+    else:
+        lines = (line.rstrip('\n') for line in diff_text)
+
+    for line in lines:
+        # Dispatch on the first character; added lines are by far the most common.
+        first = line[:1]
+        if first == '+':
+            if line.startswith('+++'):
+                current_file = line[4:].split('\t', 1)[0]  # git appends a tab to names with spaces
+                current_file = unquote_path(current_file)
+                if current_file.startswith('b/'):
+                    current_file = current_file[2:]
+            elif current_file and current_line is not None:
                 file_changes.setdefault(current_file, []).append((current_line, line[1:]))
                 current_line += 1
+        elif first == '@' and line.startswith('@@'):
+            match = HUNK_RE.match(line)
+            current_line = int(match.group(1)) if match else None
     return file_changes
 
 def is_detached_head():
@@ -38,73 +82,229 @@ def is_detached_head():
                             stderr=subprocess.DEVNULL)
     return result.returncode != 0
 
+def glob_to_regex(pattern):
+    """Translate a recursive glob pattern into a regex matching relative paths.
+
+    Follows glob.glob(recursive=True): '**' spans any number of directories,
+    other wildcards stay within one path component and, like glob, never
+    match a leading '.' unless the pattern component starts with one."""
+    parts = posixpath.normpath(pattern).split('/')
+    regex = ''
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        if part == '**':
+            regex += r'(?:(?!\.)[^/]+/)*' + (r'(?!\.)[^/]*' if last else '')
+            continue
+        if not part.startswith('.'):
+            regex += r'(?!\.)'
+        j, n = 0, len(part)
+        while j < n:
+            c = part[j]
+            j += 1
+            if c == '*':
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[':
+                # A ']' right after the opening '[' or '[!' is literal.
+                end = part.find(']', j + 2 if part[j:j + 1] == '!' else j + 1)
+                if end < 0:
+                    regex += r'\['
+                    continue
+                stuff = part[j:end]
+                j = end + 1
+                negate = stuff.startswith('!')
+                if negate:
+                    stuff = stuff[1:]
+                # Like fnmatch, drop empty ranges such as 'z-a' that match nothing.
+                stuff = re.sub(r'(.)-(.)', lambda m: m.group(0) if m.group(1) <= m.group(2) else '',
+                               stuff)
+                stuff = re.sub(r'([\\\[\]^&~|])', r'\\\1', stuff)
+                if not stuff:
+                    regex += '[^/]' if negate else '(?!)'
+                else:
+                    regex += f'[^/{stuff}]' if negate else f'[{stuff}]'
+            else:
+                regex += re.escape(c)
+        if not last:
+            regex += '/'
+    return regex
+
+
+def compile_globs(patterns):
+    """Compile glob patterns into one regex matching a path if any pattern does."""
+    if not patterns:
+        return re.compile(r'(?!)')
+    return re.compile('|'.join(f'(?:{glob_to_regex(p)})' for p in patterns))
+
+
 def get_diff_files(base_branch="master", includes=None, excludes=None):
     if is_detached_head():
-        if is_debug: print(f"Detached HEAD detected. Fetching '{base_branch}'...")
+        logger.debug("Detached HEAD detected. Fetching '%s'...", base_branch)
         subprocess.run(['git', 'fetch', 'origin', base_branch], text=True)
 
-    cmd = ['git', 'diff', '--name-only', f"origin/{base_branch}"]
-    if is_debug: print(f"git diff cmd: '{cmd}'")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-
-    changed_files = set(result.stdout.strip().splitlines())
+    # -z gives the paths verbatim instead of quoting unusual characters.
+    cmd = ['git', 'diff', '-z', '--name-only', f"origin/{base_branch}"]
+    logger.debug("git diff cmd: '%s'", cmd)
+    result = subprocess.run(cmd, capture_output=True)
 
-    if is_debug: print(f"All files '{changed_files}'")
-    # Helper to glob and normalize paths
-    def glob_relative(patterns):
-        paths = set()
-        for pattern in patterns:
-            for path in glob.glob(pattern, recursive=True):
-                try:
-                    repo_root = Path(".").resolve()
-                    rel = str(Path(path).resolve().relative_to(repo_root))
-                    paths.add(rel)
-                except ValueError:
-                    continue  # ignore files outside repo
-        return paths
+    changed_files = set()
+    for name in result.stdout.split(b'\0')[:-1]:
+        try:
+            changed_files.add(name.decode('utf-8'))
+        except UnicodeDecodeError:
+            logger.debug("Skipping file with non-UTF-8 name %r", name)
 
-    included = glob_relative(includes)
-    excluded = glob_relative(excludes)
+    logger.debug("All files '%s'", changed_files)
+    include_re = compile_globs(includes)
+    exclude_re = compile_globs(excludes)
 
-    changed_files = sorted((changed_files & included) - excluded)
-    if is_debug: print(f"Filtered files {changed_files}")
+    changed_files = sorted(f for f in changed_files
+                           if include_re.fullmatch(f) and not exclude_re.fullmatch(f))
+    logger.debug("Filtered files %s", changed_files)
 
     return changed_files
 
 
-def get_diff_lines(file, base_branch="master"):
-    cmd = ['git', 'diff', '-U0', f"origin/{base_branch}", '--', file]
-    if is_debug: print(f"Diff cmd '{cmd}'")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    return parse_diff_content(result.stdout).get(file, [])
+def get_diff_changes(files, base_branch="master"):
+    """Returns the changed lines of all given files, usually from a single `git diff`.
 
+    The paths are passed as literal pathspecs, so names with glob characters
+    such as 'docs/[x].md' do not also select other files. Lists too long for
+    one command line are split over several `git diff` calls."""
+    batches = [[]]
+    size = 0
+    for file in files:
+        if batches[-1] and size + len(file) + 1 > MAX_PATHSPEC_CHARS:
+            batches.append([])
+            size = 0
+        batches[-1].append(file)
+        size += len(file) + 1
 
-def run_spell_checker(lines, cmd="aspell list", dictionary_words=None):
-    if is_debug: print(f"Aspell cmd '{cmd}'")
+    file_changes = {}
+    for batch in batches:
+        # Keep non-ASCII paths in the '+++' headers unquoted to match the file list.
+        cmd = ['git', '--literal-pathspecs', '-c', 'core.quotePath=false',
+               'diff', '-U0', f"origin/{base_branch}", '--'] + batch
+        logger.debug("Diff cmd '%s'", cmd)
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              encoding='utf-8', errors='replace') as process:
+            file_changes.update(parse_diff_content(process.stdout))
+    return file_changes
+
+
+def get_markup_chars(cmd):
+    """Returns the characters marking lines that can carry spell checker state to later lines.
+
+    aspell's default 'url' and 'none' modes check each line on its own (''),
+    its SGML and HTML modes keep state only across tags and comments ('<>').
+    For any other mode, filter or spell checker this is unknown (None), so
+    every line has to be kept."""
+    args = cmd.split()
+    if not args or os.path.basename(args[0]) != 'aspell':
+        return None
+    mode = 'url'
+    for i, arg in enumerate(args):
+        if arg.startswith('--mode='):
+            mode = arg[len('--mode='):]
+        elif arg == '--mode' and i + 1 < len(args):
+            mode = args[i + 1]
+        elif arg in ('-H', '-t', '-e'):
+            mode = {'-H': 'html', '-t': 'tex', '-e': 'email'}[arg]
+        elif arg.startswith(('--add-filter', '--filter')):
+            return None
+    if mode in ('url', 'none'):
+        return ''
+    if mode in ('sgml', 'html'):
+        return '<>'
+    return None
+
+
+def split_batches(file_changes, markup=''):
+    """Groups the changed lines into (file, lineno, text) batches for separate spell checker runs.
+
+    A file with lines that can carry spell checker state (see get_markup_chars)
+    gets a run of its own, so e.g. an unclosed '<!--' cannot hide typos in
+    other files. Batches only split between files and do not depend on the
+    number of jobs, so the same changes are always checked the same way."""
+    batches = []
+    batch = []
+    for file, lines in file_changes.items():
+        file_lines = [(file, lineno, text) for lineno, text in lines]
+        if markup is None or any(c in text for _, text in lines for c in markup):
+            batches.append(file_lines)
+            continue
+        batch.extend(file_lines)
+        if len(batch) >= MIN_LINES_PER_JOB:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def run_spell_checker(all_lines, cmd="aspell list", dictionary_words=None):
+    """Spell check (file, lineno, text) tuples of one or more files with a single spell checker run.
+
+    Returns the annotations grouped by file, in the order the files were given."""
+    # Repeated lines spell check the same, so send each distinct line only once,
+    # and skip lines without words, e.g. brackets or numbers in data files.
+    # That no longer holds once a line may change the spell checker's state,
+    # e.g. an SGML tag or comment spanning lines: such lines are always sent,
+    # and from then on repeated lines are sent again.
+    markup = get_markup_chars(cmd)
+    input_lines = []
+    seen = set()
+    for _, _, text in all_lines:
+        if markup is None or any(c in text for c in markup):
+            input_lines.append(text)
+            seen = None
+        elif not WORD_RE.search(text):
+            continue
+        elif seen is None:
+            input_lines.append(text)
+        elif text not in seen:
+            seen.add(text)
+            input_lines.append(text)
+    if not input_lines:
+        return {}
+    logger.debug("Aspell cmd '%s'", cmd)
     process = subprocess.Popen(cmd.split(), stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
-    input_text = '\n'.join([text for _, text in lines])
-    out, _ = process.communicate(input=input_text)
-    misspelled = set(out.strip().splitlines())
-    annotations = []
-    for lineno, line in lines:
-        for word in line.split():
-            clean = ''.join(filter(str.isalpha, word))
-            if clean and clean in misspelled:
-                if dictionary_words and clean in dictionary_words:
-                    continue
-                annotations.append((lineno, clean, line.strip()))
+
+    # Feed the spell checker from a thread while its output is read here,
+    # so neither side waits for the other to finish.
+    def feed():
+        try:
+            with process.stdin:
+                for text in input_lines:
+                    process.stdin.write(text + '\n')
+        except BrokenPipeError:
+            pass  # the spell checker exited early; its output tells the rest
+
+    writer = threading.Thread(target=feed)
+    writer.start()
+    misspelled = frozenset(map(str.strip, process.stdout))
+    writer.join()
+    process.wait()
+    if dictionary_words:
+        misspelled -= dictionary_words
+    annotations = defaultdict(list)
+    for file, lineno, line in all_lines:
+        for word in WORD_RE.findall(line):
+            if word in misspelled:
+                annotations[file].append((lineno, word, line.strip()))
     return annotations
 
 
 def emit_github_annotations(file, annotations):
-    for lineno, word, context in annotations:
-        if is_debug: print(f"Emitting github annotation for file='{file}',line='{lineno}'")
-        print(f"::error file={file},line={lineno}::Possible typo: '{word}' in line: {context}")
+    logger.debug("Emitting %d github annotations for file='%s'", len(annotations), file)
+    sys.stdout.write(''.join(f"::error file={file},line={lineno}::Possible typo: '{word}' in line: {context}\n"
+                             for lineno, word, context in annotations))
 
 
 def emit_console_output(file, annotations):
-    for lineno, word, context in annotations:
-        print(f"{file}:{lineno}: typo: '{word}' in: {context}")
+    sys.stdout.write(''.join(f"{file}:{lineno}: typo: '{word}' in: {context}\n"
+                             for lineno, word, context in annotations))
 
 
 def main():
@@ -128,11 +328,15 @@ def main():
                                                    "aspell --mode=sgml"
                                                    "       --add-sgml-skip=code,pre,style,script,command,literal,ulink,parameter,filename,programlisting"
                                                    "       --lang=en list"),
-                        help='Spell checker command (default: aspell list)')
+                        help='Spell checker command (default: aspell list). Repeated lines and '
+                             'lines without words are only skipped for aspell in its url, none, '
+                             'sgml or html mode')
     parser.add_argument('--dictionary', default=os.getenv("INPUT_DICTIONARY", ""),
                         help='Space-separated list of allowed words')
     parser.add_argument('--console-output', action='store_true',
                         help='Emit console output instead of GitHub-style error annotations')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Maximum number of spell checker processes to run in parallel')
     parser.add_argument('--diff-file', help='Path to a unified diff file (optional)')
     parser.add_argument("--input-string", help="Raw text string to spellcheck directly (optional)")
     parser.add_argument("--debug", action='store_true',
@@ -140,12 +344,14 @@ def main():
 
     args = parser.parse_args()
 
-    global is_debug
     is_debug = os.getenv("INPUT_DEBUG") or args.debug
+    logging.basicConfig(stream=sys.stdout, format="%(message)s",
+                        level=logging.DEBUG if is_debug else logging.WARNING)
 
     includes = json.loads(args.include)
     excludes = json.loads(args.exclude)
-    dictionary_words = set(args.dictionary.split()) if args.dictionary else set()
+    # Split like the checked text, so entries such as 'Compiler-Research' still apply.
+    dictionary_words = frozenset(WORD_RE.findall(args.dictionary))
 
     if args.input_string:
         lines = bytes(args.input_string, "utf-8").decode("unicode_escape")
@@ -158,26 +364,36 @@ def main():
             print(f"❌ Diff file not found: {args.diff_file}")
             sys.exit(1)
         with open(args.diff_file, 'r') as f:
-            diff_text = f.read()
-        file_changes = parse_diff_content(diff_text)
+            file_changes = parse_diff_content(f)
     else:
         files = get_diff_files(args.base_branch, includes, excludes)
         if not files:
             print("✅ No files to check.")
             return
-        file_changes = {f: get_diff_lines(f, args.base_branch) for f in files}
+        file_changes = get_diff_changes(files, args.base_branch)
 
-    any_issues = False
-    for file, lines in file_changes.items():
-        annotations = run_spell_checker(lines, args.cmd, dictionary_words)
-        if annotations:
-            any_issues = True
-            if args.console_output:
-                emit_console_output(file, annotations)
-            else:
-                emit_github_annotations(file, annotations)
+    batches = split_batches(file_changes, get_markup_chars(args.cmd))
+    check = partial(run_spell_checker, cmd=args.cmd, dictionary_words=dictionary_words)
+    jobs = min(args.jobs, len(batches))
+    logger.debug("Spell checking %d batches with %d jobs", len(batches), jobs)
+    if jobs <= 1:
+        results = map(check, batches)
+    else:
+        with ThreadPoolExecutor(max_workers=jobs) as ex:
+            results = list(ex.map(check, batches))
+    annotations = {}
+    for result in results:
+        annotations.update(result)
+
+    for file in file_changes:
+        if file not in annotations:
+            continue
+        if args.console_output:
+            emit_console_output(file, annotations[file])
+        else:
+            emit_github_annotations(file, annotations[file])
 
-    if any_issues:
+    if annotations:
         sys.exit(1)
     else:
         print("✅ No typos found.")
@@ -1,16 +1,30 @@
 import subprocess
 import tempfile
 import os
+import glob
+import importlib.util
 import pytest
 from pathlib import Path
 
 SCRIPT_PATH = Path(__file__).parent.parent / "git-spell-check.py"
 
-def run_script(args=[], input_text=None):
+def load_script():
+    spec = importlib.util.spec_from_file_location("git_spell_check", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+spellcheck = load_script()
+
+def run_script(args=[], input_text=None, cwd=None):
     cmd = ["python3", str(SCRIPT_PATH)] + args
-    result = subprocess.run(cmd, input=input_text, capture_output=True, text=True)
+    result = subprocess.run(cmd, input=input_text, capture_output=True, text=True, cwd=cwd)
     return result
 
+def git(repo, *args):
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                   cwd=repo, check=True, capture_output=True)
+
 def test_diff_string_input():
     example_diff = """
 diff --git a/file.md b/file.md
@@ -33,6 +47,216 @@ def test_file_input(tmp_path):
     assert "shold" not in result.stdout
     assert "Thisss" not in result.stdout
 
+def test_diff_file_names(tmp_path):
+    diff = tmp_path / "names.diff"
+    diff.write_text(
+        "diff --git a/my file.md b/my file.md\n"
+        "--- a/my file.md\t\n"
+        "+++ b/my file.md\t\n"
+        "@@ -0,0 +1 @@\n"
+        "+Another bad werd here.\n"
+        'diff --git "a/q\\"uote.md" "b/q\\"uote.md"\n'
+        '--- "a/q\\"uote.md"\n'
+        '+++ "b/q\\"uote.md"\n'
+        "@@ -1,0 +2 @@\n"
+        "+Another bad werd here.\n"
+        'diff --git "a/\\303\\274.md" "b/\\303\\274.md"\n'
+        '--- "a/\\303\\274.md"\n'
+        '+++ "b/\\303\\274.md"\n'
+        "@@ -0,0 +3 @@\n"
+        "+Another bad werd here.\n", encoding="utf-8")
+    result = run_script(["--diff-file", str(diff), "--console-output"])
+    assert result.returncode == 1
+    assert result.stdout.splitlines() == [
+        "my file.md:1: typo: 'werd' in: Another bad werd here.",
+        "q\"uote.md:2: typo: 'werd' in: Another bad werd here.",
+        "\u00fc.md:3: typo: 'werd' in: Another bad werd here.",
+    ]
+
+def test_git_diff_multiple_files(tmp_path):
+    git(tmp_path, "init", "-q")
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "README.md").write_text("This is a sentence.\n")
+    (tmp_path / "docs/a.md").write_text("This is a sentence.\n")
+    (tmp_path / "docs/gone.md").write_text("Another bad werd here.\n")
+    (tmp_path / "code.py").write_text("# This is a sentence.\n")
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "commit", "-qm", "base")
+    git(tmp_path, "update-ref", "refs/remotes/origin/master", "HEAD")
+
+    (tmp_path / "README.md").write_text("This is a sentence.\nAnother bad werd here.\n")
+    (tmp_path / "docs/a.md").write_text("Thiss line has spelling errors.\nThis is a sentence.\n")
+    (tmp_path / "docs/new.md").write_text("Another bad werd here.\n")
+    (tmp_path / "docs/gone.md").unlink()
+    (tmp_path / "code.py").write_text("# Another bad werd here.\n")
+    git(tmp_path, "add", "docs/new.md")
+
+    result = run_script(["--base-branch", "master", "--console-output"], cwd=tmp_path)
+    assert result.returncode == 1
+    assert result.stdout.splitlines() == [
+        "README.md:2: typo: 'werd' in: Another bad werd here.",
+        "docs/a.md:1: typo: 'Thiss' in: Thiss line has spelling errors.",
+        "docs/new.md:1: typo: 'werd' in: Another bad werd here.",
+    ]
+
+def test_git_diff_literal_paths(tmp_path, monkeypatch):
+    git(tmp_path, "init", "-q")
+    (tmp_path / "docs").mkdir()
+    for name in ["docs/[x].md", "docs/x.md", "docs/y.md"]:
+        (tmp_path / name).write_text("This is a sentence.\n")
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "commit", "-qm", "base")
+    git(tmp_path, "update-ref", "refs/remotes/origin/master", "HEAD")
+    for name in ["docs/[x].md", "docs/x.md", "docs/y.md"]:
+        (tmp_path / name).write_text("This is a sentence.\nAnother bad werd here.\n")
+
+    # '[x]' must not act as a glob and pull in the excluded docs/x.md.
+    result = run_script(["--base-branch", "master", "--console-output",
+                         "--exclude", '["docs/x.md"]'], cwd=tmp_path)
+    assert result.returncode == 1
+    assert result.stdout.splitlines() == [
+        "docs/[x].md:2: typo: 'werd' in: Another bad werd here.",
+        "docs/y.md:2: typo: 'werd' in: Another bad werd here.",
+    ]
+
+    # Long path lists are split over several git diff calls.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(spellcheck, "MAX_PATHSPEC_CHARS", 1)
+    changes = spellcheck.get_diff_changes(["docs/[x].md", "docs/y.md"])
+    assert changes == {"docs/[x].md": [(2, "Another bad werd here.")],
+                       "docs/y.md": [(2, "Another bad werd here.")]}
+
+def test_unquote_path():
+    assert spellcheck.unquote_path("b/plain.md") == "b/plain.md"
+    assert spellcheck.unquote_path('"b/q\\"uote\\\\.md"') == 'b/q"uote\\.md'
+    assert spellcheck.unquote_path('"b/tab\\tx.md"') == "b/tab\tx.md"
+    assert spellcheck.unquote_path('"b/\\303\\274.md"') == "b/\u00fc.md"
+    assert spellcheck.unquote_path('"b/\\377.md"') == "b/\ufffd.md"
+
+def test_git_diff_non_utf8_name(tmp_path):
+    git(tmp_path, "init", "-q")
+    (tmp_path / "README.md").write_text("This is a sentence.\n")
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "commit", "-qm", "base")
+    git(tmp_path, "update-ref", "refs/remotes/origin/master", "HEAD")
+    (tmp_path / "README.md").write_text("This is a sentence.\nAnother bad werd here.\n")
+    try:
+        with open(os.path.join(os.fsencode(tmp_path), b"bad\xff.md"), "wb") as f:
+            f.write(b"Another bad werd here.\n")
+    except OSError:
+        pytest.skip("file system does not allow non-UTF-8 names")
+    git(tmp_path, "add", "-A")
+
+    result = run_script(["--base-branch", "master", "--console-output"], cwd=tmp_path)
+    assert result.returncode == 1
+    assert result.stdout.splitlines() == [
+        "README.md:2: typo: 'werd' in: Another bad werd here.",
+    ]
+
+def test_dictionary():
+    text = "Another bad werd here.\\nUses Clang-wurd here."
+    result = run_script(["--input-string", text, "--console-output"])
+    assert result.returncode == 1
+    assert "'werd'" in result.stdout
+    assert "'wurd'" in result.stdout
+
+    result = run_script(["--input-string", text, "--dictionary", "werd Clang-wurd"])
+    assert result.returncode == 0
+    assert result.stdout.strip() == "✅ No typos found."
+
+def recording_aspell(tmp_path):
+    """Creates an 'aspell' stand-in that records its input and finds no typos."""
+    script = tmp_path / "aspell"
+    script.write_text(f"#!/bin/sh\ncat > {tmp_path / 'input.txt'}\n")
+    script.chmod(0o755)
+    return script
+
+def test_sgml_repeated_pre():
+    text = "<pre>\\nqzxcode\\n</pre>\\nSome text.\\n<pre>\\nqzxother\\n</pre>\\nqzxcode"
+    result = run_script(["--input-string", text, "--console-output"])
+    # The repeated line is checked again as prose, the second block stays skipped.
+    assert result.returncode == 1
+    assert "<stdin>:8: typo: 'qzxcode' in: qzxcode" in result.stdout.splitlines()
+    assert "qzxother" not in result.stdout
+
+def test_sgml_repeated_comment():
+    text = "<!--\\nqzxa note\\n-->\\nSome text.\\n<!--\\nqzxb note\\n-->\\nSome text."
+    result = run_script(["--input-string", text])
+    assert result.returncode == 0
+    assert result.stdout.strip() == "✅ No typos found."
+
+@pytest.mark.parametrize("mode, sent", [
+    ("--mode=none", "Some text.\nAnother line.\n"),
+    ("--mode=markdown", "Some text.\nAnother line.\nSome text.\n"),
+    ("--mode=tex", "Some text.\nAnother line.\nSome text.\n"),
+])
+def test_deduplicate_only_stateless_modes(tmp_path, mode, sent):
+    aspell = recording_aspell(tmp_path)
+    text = "Some text.\\nAnother line.\\nSome text."
+    run_script(["--input-string", text, "--cmd", f"{aspell} {mode} list"])
+    assert (tmp_path / "input.txt").read_text() == sent
+
+@pytest.mark.parametrize("text", [
+    '<img src="a.png"\\n/>\\nAnother bad werd here.',
+    "<!-- note\\n-->\\nAnother bad werd here.",
+])
+def test_markup_only_line_between_prose(text):
+    # Without the closing line aspell would stay inside the tag or comment.
+    result = run_script(["--input-string", text, "--console-output"])
+    assert result.returncode == 1
+    assert result.stdout.splitlines() == ["<stdin>:3: typo: 'werd' in: Another bad werd here."]
+
+@pytest.mark.parametrize("mode, sent", [
+    ("--mode=none", "Some text.\n"),
+    ("--mode=markdown", "```\nSome text.\n```\n42\n"),
+    ("--mode=tex", "$$\nSome text.\n$$\n42\n"),
+])
+def test_keep_lines_without_words(tmp_path, mode, sent):
+    aspell = recording_aspell(tmp_path)
+    fence = "$$" if "tex" in mode else "```"
+    text = f"{fence}\\nSome text.\\n{fence}\\n42"
+    run_script(["--input-string", text, "--cmd", f"{aspell} {mode} list"])
+    assert (tmp_path / "input.txt").read_text() == sent
+
+def test_parallel_jobs():
+    text = "\\n".join(["This is a sentence."] * 2500 + ["Another bad werd here."])
+    result = run_script(["--input-string", text, "--jobs", "4", "--console-output"])
+    assert result.returncode == 1
+    assert result.stdout.strip() == "<stdin>:2501: typo: 'werd' in: Another bad werd here."
+
+def test_no_words_skips_spell_checker():
+    # The command does not exist, so starting it would fail the run.
+    result = run_script(["--input-string", "{\\n],\\n42\\n", "--cmd", "/no/such/aspell list"])
+    assert result.returncode == 0
+    assert result.stdout.strip() == "✅ No typos found."
+
+def test_markup_does_not_leak_into_other_files(tmp_path):
+    # The comment is closed on an unchanged line, so -U0 never shows the '-->'.
+    diff = tmp_path / "markup.diff"
+    diff.write_text(
+        "diff --git a/a.html b/a.html\n--- a/a.html\n+++ b/a.html\n"
+        "@@ -1,0 +2 @@\n"
+        "+<!-- start of note\n"
+        "diff --git a/b.md b/b.md\n--- a/b.md\n+++ b/b.md\n"
+        "@@ -0,0 +1 @@\n"
+        "+Another bad werd here.\n")
+    result = run_script(["--diff-file", str(diff), "--console-output"])
+    assert result.returncode == 1
+    assert result.stdout.splitlines() == ["b.md:1: typo: 'werd' in: Another bad werd here."]
+
+def test_jobs_split_between_files(tmp_path):
+    diff = tmp_path / "many.diff"
+    with open(diff, "w") as f:
+        for n in range(4):
+            f.write(f"diff --git a/f{n}.md b/f{n}.md\n--- a/f{n}.md\n+++ b/f{n}.md\n"
+                    "@@ -0,0 +1,700 @@\n")
+            f.write("+This is a sentence.\n" * 699 + "+Another bad werd here.\n")
+    expected = [f"f{n}.md:700: typo: 'werd' in: Another bad werd here." for n in range(4)]
+    for jobs in ["1", "3"]:
+        result = run_script(["--diff-file", str(diff), "--jobs", jobs, "--console-output"])
+        assert result.returncode == 1
+        assert result.stdout.splitlines() == expected
+
 def test_empty_string():
     result = run_script(["--input-string", " "])
     assert result.returncode == 0
@@ -42,3 +266,35 @@ def test_help_flag():
     result = run_script(["--help"])
     assert result.returncode == 0
     assert "usage" in result.stdout.lower()
+
+DEFAULT_INCLUDES = ["**/*.md", "**/*.txt", "**/*.rst", "**/*.json", "**/*.yaml",
+                    "**/*.yml", "**/*.ini", "**/*.tex", "**/*.html", "**/*.xml",
+                    "**/*.xhtml", "**/*.csv"]
+
+@pytest.mark.parametrize("pattern", DEFAULT_INCLUDES + [
+    "*.md", "docs/*.md", "./docs/*.md", "docs/**", "docs/**/*.txt", "**",
+    "**/.*", ".github/**", "**/.github/*/*.yml", "docs/[!x]*.md", "docs/[]x].md",
+    "docs/[[]x].md", "docs/[a-c]*", "docs/?.md", "docs/**/**/deep.md",
+    "docs/[z-a].md", "docs/[!z-a].md", "docs/[z-ax].md", "docs/[-x].md",
+])
+def test_glob_to_regex_matches_glob(tmp_path, monkeypatch, pattern):
+    for name in ["README.md", ".hidden.md", "notes.txt", "data.json", "docs/a.md",
+                 "docs/x.md", "docs/[x].md", "docs/]x.md", "docs/sub/b.txt",
+                 "docs/sub/deep/deep.md", ".github/workflows/test.yml",
+                 "src/main.py", "src/.cache/c.yml", "site/index.html"]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    monkeypatch.chdir(tmp_path)
+
+    files = [os.path.relpath(os.path.join(root, f))
+             for root, _, names in os.walk(".") for f in names]
+    expected = {os.path.relpath(p) for p in glob.glob(pattern, recursive=True)
+                if os.path.isfile(p)}
+    regex = spellcheck.compile_globs([pattern])
+    assert {f for f in files if regex.fullmatch(f)} == expected
+
+def test_empty_globs_match_nothing():
+    regex = spellcheck.compile_globs([])
+    assert not regex.fullmatch("README.md")
+    assert not regex.fullmatch("")